@@ -1,11 +1,123 @@
 from abc import ABC, abstractmethod
-from io import IOBase
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from io import BufferedReader, FileIO, IOBase, RawIOBase
 from zipfile import ZipFile, ZipInfo, ZipExtFile, ZIP_STORED
 from zipfile import _SharedFile, structFileHeader, sizeFileHeader, BadZipFile, _FH_SIGNATURE, stringFileHeader, _FH_FILENAME_LENGTH, _FH_EXTRA_FIELD_LENGTH # type: ignore
 from stream_unzip import stream_unzip
+import copy
 import struct
 import os
-from typing import Generator, Optional, Sequence, Union
+import zlib
+from typing import Generator, Iterable, Iterator, Optional, Sequence, Union
+
+# Number of bytes read past the fixed-size local file header in one go, to also cover the filename and extra field
+_FH_READAHEAD = 4096
+
+# Precompiled struct for parsing local file headers
+_FH_STRUCT = struct.Struct(structFileHeader)
+
+# Buffer size used when wrapping an unbuffered file object given to EDZipFile
+_BUFFER_SIZE = 64 * 1024
+
+# General purpose flag bits for encrypted entries and entries whose sizes and CRC follow the data
+_MASK_ENCRYPTED = 0x1
+_MASK_USE_DATA_DESCRIPTOR = 0x8
+
+# Maximum number of ZipInfo objects cached by EDZipFile.getinfo()
+_GETINFO_CACHE_SIZE = 4096
+
+# Maximum distance between the first and last local file header (or end of data) read with a single pread()
+_PREAD_SPAN = 4 * 1024 * 1024
+
+# Maximum gap between consecutive headers (or entry data) for them to still be fetched with the same pread()
+_PREAD_MERGE_GAP = 64 * 1024
+
+# Number of bytes the OS is asked to read ahead from the start of the next batch of headers in fillinfos()
+_PREFETCH_SIZE = 64 * 1024
+
+
+class _NonClosingBufferedReader(BufferedReader):
+    """A BufferedReader that detaches from, instead of closing, the raw stream it wraps.
+
+    Used to buffer unbuffered file objects passed in by the user, which remain theirs to close.
+    """
+
+    def close(self):
+        if not self.closed:
+            self.detach()
+
+    @property
+    def closed(self) -> bool:
+        try:
+            return self.raw.closed
+        except ValueError:
+            # Raw stream already detached
+            return True
+
+
+def _parse_local_header(zinfo: ZipInfo, buf: bytes, pos: int = 0, need_times: bool = True) -> Optional[int]:
+    """Fill the given ZipInfo object from the local file header at the given position of the buffer.
+
+    If need_times is False, zinfo.date_time is not decoded from the header (zinfo._raw_time still is).
+
+    Returns:
+        Optional[int]: The length of the header, or None if the buffer does not hold the complete header.
+    """
+    if len(buf) - pos < sizeFileHeader:
+        return None
+    fheader = _FH_STRUCT.unpack_from(buf, pos)
+    if fheader[_FH_SIGNATURE] != stringFileHeader:
+        raise BadZipFile("Bad magic number for file header")
+    name_start = pos + sizeFileHeader
+    extra_start = name_start + fheader[_FH_FILENAME_LENGTH]
+    end = extra_start + fheader[_FH_EXTRA_FIELD_LENGTH]
+    if len(buf) < end:
+        return None
+    (zinfo.extract_version, zinfo.reserved,
+     zinfo.flag_bits, zinfo.compress_type, t, d,
+     zinfo.CRC, zinfo.compress_size, zinfo.file_size) = fheader[1:10]
+    zinfo._raw_time = t
+    if need_times:
+        zinfo.date_time = ((d >> 9) + 1980, (d >> 5) & 0xF, d & 0x1F,
+                           t >> 11, (t >> 5) & 0x3F, (t & 0x1F) * 2)
+    zinfo.orig_filename = buf[name_start:extra_start]
+    zinfo.extra = buf[extra_start:end]
+    if fheader[_FH_EXTRA_FIELD_LENGTH]:
+        zinfo._decodeExtra()
+    return end - pos
+
+
+def _pread(fd: int, size: int, offset: int) -> bytes:
+    """Read size bytes at the given offset of the file descriptor, or fewer only if the end of the file is reached.
+
+    A single os.pread() may return less than asked for, e.g. at most 0x7ffff000 bytes on Linux.
+    """
+    parts = []
+    while size > 0:
+        part = os.pread(fd, size, offset)
+        if not part:
+            break
+        parts.append(part)
+        size -= len(part)
+        offset += len(part)
+    return b"".join(parts)
+
+
+def _fileno(fp) -> Optional[int]:
+    """Return the OS-level file descriptor of the given file object, or None if it is not a plain file.
+
+    Only plain files, possibly buffered, have stream positions that map 1:1 onto their file descriptor. Wrappers such as
+    gzip.GzipFile also have a fileno(), but it belongs to the underlying compressed file.
+    """
+    raw = fp.raw if isinstance(fp, BufferedReader) else fp
+    if not isinstance(raw, FileIO):
+        return None
+    try:
+        return raw.fileno()
+    except (OSError, ValueError):
+        return None
+
 
 class ExternalDirectory(ABC):
     
@@ -26,6 +138,13 @@ class ExternalDirectory(ABC):
     def getinfo(self, name: str) -> ZipInfo:
         pass
 
+    def getinfos(self, names: Iterable[str]) -> list[ZipInfo]:
+        return [self.getinfo(name) for name in names]
+
+    def getpositions(self, positions: Iterable[int]) -> list[ZipInfo]:
+        infolist = self.infolist()
+        return [infolist[position] for position in positions]
+
 class EDZipFile(ZipFile):
     """A subclass of ZipFile that reads the directory information from an external SQLite database.
     """
@@ -37,8 +156,15 @@ class EDZipFile(ZipFile):
             file (str or os.PathLike or BinaryIO): The ZIP file to read from.
             con (sqlite3.Connection): The SQLite3 database connection to the external directory.
         """
+        # Set before ZipFile.__init__, as close() may get called from there on failure
+        self._infolist_cache: Optional[list[ZipInfo]] = None
+        self._getinfo_cache: OrderedDict[str, ZipInfo] = OrderedDict()
         super().__init__(file, 'r', ZIP_STORED, True, None) # type: ignore
+        if isinstance(self.fp, RawIOBase):
+            # Small seek()+read() pairs on an unbuffered stream would each cost a syscall
+            self.fp = _NonClosingBufferedReader(self.fp, _BUFFER_SIZE)
         self.ed = ed
+        self._fd = _fileno(self.fp)
 
     def __len__(self) -> int:
         """Return the number of items in the EDZip object.
@@ -51,6 +177,12 @@ class EDZipFile(ZipFile):
     def _RealGetContents(self):
         pass
 
+    def close(self):
+        """Close the archive, dropping cached directory information."""
+        self._getinfo_cache.clear()
+        self._infolist_cache = None
+        super().close()
+
     def namelist(self) -> Sequence[str]:
         """Returns a sequence of filenames stored in the ZIP archive.
 
@@ -59,15 +191,23 @@ class EDZipFile(ZipFile):
         """
         return self.ed.namelist()
 
-    def infolist(self) -> Sequence[ZipInfo]:
+    def infolist(self, materialize: bool = False) -> Sequence[ZipInfo]:
         """Return a sequence of ZipInfo objects for all files in the archive.
 
+        Args:
+            materialize (bool): If True, read the whole directory into a list, which is cached and returned on subsequent
+                materializing calls. Otherwise, return a lazy sequence backed by the external directory.
+
         Returns:
             Sequence[ZipInfo]: sequence of ZipInfo objects.
                 Note that the ZipInfo objects returned have only offset info filled in.
                 To get all info, call fillinfo() with each object.
         """
-        return self.ed.infolist()
+        if not materialize:
+            return self.ed.infolist()
+        if self._infolist_cache is None:
+            self._infolist_cache = list(self.ed.infolist())
+        return self._infolist_cache
 
     def getinfo(self, name) -> ZipInfo:
         """Retrieves information about a file in the archive.
@@ -79,38 +219,134 @@ class EDZipFile(ZipFile):
             ZipInfo: An object containing offset information for the specified file.
                 Note that the object returned has only offset info filled in.
                 To get all info, call fillinfo() with it.
+                The most recently retrieved objects are cached, so repeated calls for the same name return the same
+                object, including any information filled into it by an earlier fillinfo() call.
         """
-        return self.ed.getinfo(name)
+        with self._lock:
+            zinfo = self._getinfo_cache.get(name)
+            if zinfo is not None:
+                self._getinfo_cache.move_to_end(name)
+                return zinfo
+        zinfo = self.ed.getinfo(name)
+        with self._lock:
+            self._getinfo_cache[name] = zinfo
+            if len(self._getinfo_cache) > _GETINFO_CACHE_SIZE:
+                self._getinfo_cache.popitem(last=False)
+        return zinfo
+
+    def getinfos(self, names: Iterable[str]) -> list[ZipInfo]:
+        """Retrieves information about multiple files in the archive at once.
+
+        Args:
+            names (Iterable[str]): The names of the files to retrieve information for.
 
-    def fillinfo(self, zinfo: ZipInfo) -> ZipInfo:
+        Returns:
+            list[ZipInfo]: Objects containing offset information for the specified files, in the order given.
+                Note that the objects returned have only offset info filled in.
+                To get all info, call fillinfos() with them.
+        """
+        return self.ed.getinfos(names)
+
+    def getpositions(self, positions: Iterable[int]) -> list[ZipInfo]:
+        """Retrieves information about the files at the given positions in the archive directory.
+
+        Args:
+            positions (Iterable[int]): The entry numbers of the files to retrieve information for.
+
+        Returns:
+            list[ZipInfo]: Objects containing offset information for the specified files, in the order given.
+                Note that the objects returned have only offset info filled in.
+                To get all info, call fillinfos() with them.
+        """
+        return self.ed.getpositions(positions)
+
+    def fillinfo(self, zinfo: ZipInfo, need_times: bool = True) -> ZipInfo:
         """Fill the given ZipInfo object with further information about the file in the archive.
 
         Args:
             zinfo (ZipInfo): The ZipInfo object to fill in with information.
+            need_times (bool): If False, skip decoding the modification time into zinfo.date_time.
 
         Returns:
             ZipInfo: The filled-in ZipInfo object.
         """
-        self.fp.seek(zinfo.header_offset)
-        fheader = self.fp.read(sizeFileHeader)
-        if len(fheader) != sizeFileHeader:
-            raise BadZipFile("Truncated file header")
-        fheader = struct.unpack(structFileHeader, fheader)
-        if fheader[_FH_SIGNATURE] != stringFileHeader:
-            raise BadZipFile("Bad magic number for file header")
-        (zinfo.extract_version, zinfo.reserved,
-         zinfo.flag_bits, zinfo.compress_type, t, d,
-         zinfo.CRC, zinfo.compress_size, zinfo.file_size) = fheader[1:10]
-        zinfo._raw_time = t
-        zinfo.date_time = ((d >> 9) + 1980, (d >> 5) & 0xF, d & 0x1F,
-                           t >> 11, (t >> 5) & 0x3F, (t & 0x1F) * 2)
-        zinfo.extra = self.fp.read(fheader[_FH_EXTRA_FIELD_LENGTH])
-        zinfo.orig_filename = self.fp.read(fheader[_FH_FILENAME_LENGTH])
-        if fheader[_FH_EXTRA_FIELD_LENGTH]:
-            zinfo.extra = self.fp.read(fheader[_FH_EXTRA_FIELD_LENGTH])
-            zinfo._decodeExtra()
+        self._read_local_header(zinfo, need_times)
         return zinfo
 
+    def _read_local_header(self, zinfo: ZipInfo, need_times: bool = True) -> int:
+        """Fill the given ZipInfo object from its local file header, returning the offset of the file data."""
+        self.fp.seek(zinfo.header_offset)
+        buf = self.fp.read(sizeFileHeader + _FH_READAHEAD)
+        header_len = _parse_local_header(zinfo, buf, 0, need_times)
+        if header_len is None:
+            # The speculative read did not cover the variable-length fields
+            if len(buf) < sizeFileHeader:
+                raise BadZipFile("Truncated file header")
+            fheader = _FH_STRUCT.unpack_from(buf)
+            buf += self.fp.read(sizeFileHeader + fheader[_FH_FILENAME_LENGTH] + fheader[_FH_EXTRA_FIELD_LENGTH] - len(buf))
+            header_len = _parse_local_header(zinfo, buf, 0, need_times)
+            if header_len is None:
+                raise BadZipFile("Truncated file header")
+        return zinfo.header_offset + header_len
+
+    def fillinfos(self, zinfos: Iterable[ZipInfo], need_times: bool = True) -> list[ZipInfo]:
+        """Fill the given ZipInfo objects with further information about the files in the archive.
+
+        When the archive is backed by an OS-level file, headers lying close to each other are read with a single pread()
+        call, and the OS is asked to read ahead the next batch while the current one is parsed. This makes filling in
+        many objects at once considerably faster than calling fillinfo() on each.
+
+        Args:
+            zinfos (Iterable[ZipInfo]): The ZipInfo objects to fill in with information.
+            need_times (bool): If False, skip decoding the modification times into date_time.
+
+        Returns:
+            list[ZipInfo]: The filled-in ZipInfo objects, in the order given.
+        """
+        zinfos = list(zinfos)
+        self._read_local_headers(zinfos, need_times)
+        return zinfos
+
+    def _read_local_headers(self, zinfos: list[ZipInfo], need_times: bool = True) -> list[int]:
+        """Fill the given ZipInfo objects from their local file headers, returning the offsets of the file data."""
+        if not self.fp:
+            raise ValueError(
+                "Attempt to use ZIP archive that was already closed")
+        data_offsets = [0] * len(zinfos)
+        if self._fd is None or not hasattr(os, "pread"):
+            for i, zinfo in enumerate(zinfos):
+                if i + 1 < len(zinfos):
+                    self._prefetch(zinfos[i + 1].header_offset)
+                data_offsets[i] = self._read_local_header(zinfo, need_times)
+            return data_offsets
+        # Group headers, in file order, into runs that can each be fetched with one read
+        runs: list[list[int]] = []
+        for i in sorted(range(len(zinfos)), key=lambda i: zinfos[i].header_offset):
+            offset = zinfos[i].header_offset
+            if runs and offset - zinfos[runs[-1][-1]].header_offset <= _PREAD_MERGE_GAP \
+                    and offset - zinfos[runs[-1][0]].header_offset <= _PREAD_SPAN:
+                runs[-1].append(i)
+            else:
+                runs.append([i])
+        for r, run in enumerate(runs):
+            if r + 1 < len(runs):
+                self._prefetch(zinfos[runs[r + 1][0]].header_offset)
+            start = zinfos[run[0]].header_offset
+            buf = os.pread(self._fd, zinfos[run[-1]].header_offset - start + sizeFileHeader + _FH_READAHEAD, start)
+            for i in run:
+                zinfo = zinfos[i]
+                header_len = _parse_local_header(zinfo, buf, zinfo.header_offset - start, need_times)
+                if header_len is None:
+                    data_offsets[i] = self._read_local_header(zinfo, need_times)
+                else:
+                    data_offsets[i] = zinfo.header_offset + header_len
+        return data_offsets
+
+    def _prefetch(self, offset: int):
+        """Advise the OS that the local file header at the given offset will be read soon."""
+        if self._fd is not None and hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(self._fd, offset, _PREFETCH_SIZE, os.POSIX_FADV_WILLNEED)
+
     def open(self, name: Union[str, ZipInfo], mode: str = "r", pwd: Optional[bytes] = None, *,
              force_zip6: bool = False) -> ZipExtFile:
         """Open the file specified by 'name' inside the ZIP archive for reading.
@@ -130,12 +366,109 @@ class EDZipFile(ZipFile):
             raise ValueError(
                 "Attempt to use ZIP archive that was already closed")
         if isinstance(name, str):
-            name = self.getinfo(name)
-        self.fillinfo(name)
+            # Work on a copy, as the header is read into the object and getinfo() may return a cached one. The copy is
+            # only seen by ZipExtFile, which does not use date_time.
+            name = copy.copy(self.getinfo(name))
+            data_offset = self._read_local_header(name, need_times=False)
+        else:
+            # The caller's own object gets fully filled in, as with fillinfo()
+            data_offset = self._read_local_header(name)
+        return self._open_at(self.fp, name, data_offset, pwd)
+
+    def _open_at(self, fp, zinfo: ZipInfo, data_offset: int, pwd: Optional[bytes] = None) -> ZipExtFile:
+        """Open the file described by the given, already filled ZipInfo, whose data starts at the given offset of fp."""
         self._fileRefCnt += 1
-        zef_file = _SharedFile(self.fp, self.fp.tell(),
+        zef_file = _SharedFile(fp, data_offset,
                                self._fpclose, self._lock, lambda: self._writing)
-        return ZipExtFile(zef_file, mode, name, pwd, True)
+        return ZipExtFile(zef_file, "r", zinfo, pwd, True)
+
+    def open_many(self, names: Iterable[str], max_workers: int = 8) -> Iterator[tuple[str, bytes]]:
+        """Read the contents of many files in the archive, with the reads done in parallel threads.
+
+        When the archive is backed by an OS-level file, the data of uncompressed entries is read with pread() calls
+        issued from a thread pool, entries lying close to each other being fetched with a single call. Other entries
+        are read through open(). Reads run ahead of the consumer by at most about 2*max_workers ranges.
+
+        Args:
+            names (Iterable[str]): The names of the files to read.
+            max_workers (int): The maximum number of threads used for reading.
+
+        Yields:
+            (str,bytes): tuple of (filename, file contents) for each file, in the order the names were given.
+        """
+        fp = self.fp
+        if not fp:
+            raise ValueError(
+                "Attempt to use ZIP archive that was already closed")
+        # Hold a reference on the file like ZipExtFile does, so that it stays open if the archive is closed mid-iteration
+        self._fileRefCnt += 1
+        try:
+            yield from self._open_many(fp, list(names), max_workers)
+        finally:
+            self._fpclose(fp)
+
+    def _open_many(self, fp, names: list[str], max_workers: int) -> Iterator[tuple[str, bytes]]:
+        zinfos = self.getinfos(names)
+        data_offsets = self._read_local_headers(zinfos, need_times=False)
+        if self._fd is None or not hasattr(os, "pread"):
+            for i, (name, zinfo) in enumerate(zip(names, zinfos)):
+                with self._open_at(fp, zinfo, data_offsets[i]) as f:
+                    yield name, f.read()
+            return
+        # Group the data of plain stored entries, in file order, into ranges that can each be fetched with one read
+        ranges: list[list[int]] = []
+        range_of: dict[int, int] = {}
+        for i in sorted(range(len(zinfos)), key=lambda i: data_offsets[i]):
+            zinfo = zinfos[i]
+            if zinfo.compress_type != ZIP_STORED or zinfo.flag_bits & (_MASK_ENCRYPTED | _MASK_USE_DATA_DESCRIPTOR):
+                continue
+            start = data_offsets[i]
+            end = start + zinfo.compress_size
+            if ranges and start - ranges[-1][1] <= _PREAD_MERGE_GAP and end - ranges[-1][0] <= _PREAD_SPAN:
+                ranges[-1][1] = max(ranges[-1][1], end)
+            else:
+                ranges.append([start, end])
+            range_of[i] = len(ranges) - 1
+        remaining = [0] * len(ranges)
+        # Ranges in the order they are first needed, which is the order they are submitted in
+        submit_order: list[int] = []
+        for i in range(len(zinfos)):
+            r = range_of.get(i)
+            if r is not None:
+                if not remaining[r]:
+                    submit_order.append(r)
+                remaining[r] += 1
+        max_in_flight = 2 * max_workers
+        futures: dict[int, Future[bytes]] = {}
+        submitted = 0
+        executor = ThreadPoolExecutor(max_workers)
+        try:
+            for i, (name, zinfo) in enumerate(zip(names, zinfos)):
+                r = range_of.get(i)
+                if r is None:
+                    with self._open_at(fp, zinfo, data_offsets[i]) as f:
+                        yield name, f.read()
+                    continue
+                # Keep a limited number of ranges read or being read but not yet handed out. The range needed now
+                # is always submitted, even if that goes over the limit.
+                while submitted < len(submit_order) and (len(futures) < max_in_flight or r not in futures):
+                    nr = submit_order[submitted]
+                    futures[nr] = executor.submit(_pread, self._fd, ranges[nr][1] - ranges[nr][0], ranges[nr][0])
+                    submitted += 1
+                buf = futures[r].result()
+                pos = data_offsets[i] - ranges[r][0]
+                data = buf[pos:pos + zinfo.compress_size]
+                remaining[r] -= 1
+                if not remaining[r]:
+                    # Release the buffer once all its entries have been handed out
+                    del futures[r]
+                if len(data) != zinfo.compress_size:
+                    raise EOFError
+                if zlib.crc32(data) != zinfo.CRC:
+                    raise BadZipFile("Bad CRC-32 for file %r" % name)
+                yield name, data
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
 
     def stream_from(self, name: Optional[Union[str, ZipInfo]] = None) -> Generator[
         tuple[str, int, Generator[bytes, None, None]], None, None]:
@@ -1,15 +1,60 @@
+import json
+import mmap
 import os
 import sqlite3
-from typing import Callable, Iterator, Optional, Sequence, TypeVar
-from zipfile import ZipFile, ZipInfo
+import struct
+from typing import BinaryIO, Callable, Iterable, Iterator, Optional, Sequence, TypeVar, Union
+from zipfile import ZIP_STORED, BadZipFile, ZipFile, ZipInfo
+from zipfile import _EndRecData, _ECD_ENTRIES_TOTAL, _ECD_LOCATION, _ECD_OFFSET, _ECD_SIGNATURE, _ECD_SIZE, _CD_COMMENT_LENGTH, _CD_COMPRESSED_SIZE, _CD_EXTRA_FIELD_LENGTH, _CD_FILENAME_LENGTH, _CD_FLAG_BITS, _CD_LOCAL_HEADER_OFFSET, _CD_SIGNATURE, _CD_UNCOMPRESSED_SIZE, sizeCentralDir, sizeEndCentDir64, sizeEndCentDir64Locator, stringCentralDir, stringEndArchive64, structCentralDir # type: ignore
 
 import click
 from tqdm import tqdm
 
-from edzip import ExternalDirectory
+from edzip import ExternalDirectory, _fileno
 
 T_co = TypeVar('T_co', covariant=True)
 
+# General purpose flag bit marking UTF-8 encoded filenames
+_MASK_UTF_FILENAME = 0x800
+
+# Precompiled struct for parsing central directory records
+_CD_STRUCT = struct.Struct(structCentralDir)
+
+_ZINFO_TEMPLATE = ZipInfo()
+_ZINFO_CREATE_SYSTEM = _ZINFO_TEMPLATE.create_system
+_ZINFO_VERSION = _ZINFO_TEMPLATE.create_version
+# Default attributes not set explicitly in _new_zinfo (which ones exist depends on the Python version)
+_ZINFO_OTHER_DEFAULTS = tuple((slot, getattr(_ZINFO_TEMPLATE, slot)) for slot in ZipInfo.__slots__
+                              if hasattr(_ZINFO_TEMPLATE, slot) and slot not in (
+                                  'orig_filename', 'filename', 'date_time', 'compress_type', 'comment', 'extra',
+                                  'create_system', 'create_version', 'extract_version', 'reserved', 'flag_bits',
+                                  'volume', 'internal_attr', 'external_attr', 'compress_size', 'file_size'))
+
+
+def _new_zinfo(filename: str, header_offset: int, compress_size: int) -> ZipInfo:
+    """Create a ZipInfo with the same defaults as ZipInfo(filename), but without going through ZipInfo.__init__.
+
+    The filename normalization done there is not needed, as the names in the directory come from already parsed ZipInfos.
+    """
+    zi = ZipInfo.__new__(ZipInfo)
+    zi.orig_filename = zi.filename = filename
+    zi.header_offset = header_offset
+    zi.compress_size = compress_size
+    zi.date_time = (1980, 1, 1, 0, 0, 0)
+    zi.compress_type = ZIP_STORED
+    zi.comment = b""
+    zi.extra = b""
+    zi.create_system = _ZINFO_CREATE_SYSTEM
+    zi.create_version = zi.extract_version = _ZINFO_VERSION
+    zi.reserved = zi.flag_bits = zi.volume = zi.internal_attr = zi.external_attr = zi.file_size = 0
+    for slot, value in _ZINFO_OTHER_DEFAULTS:
+        setattr(zi, slot, value)
+    return zi
+
+
+# Number of rows fetched from SQLite at a time when iterating over a directory
+_FETCH_SIZE = 1024
+
 
 class _SqliteBackedSequence(Sequence[T_co]):
 
@@ -20,32 +65,110 @@ class _SqliteBackedSequence(Sequence[T_co]):
         self.fields = fields
         self.conversion = conversion
         self._len = _len
+        select = f"SELECT {fields} FROM {table_name}"
+        self._sql_all = select
+        self._sql_rev = f"{select} ORDER BY {entry_number_field} DESC"
+        self._sql_between = f"{select} WHERE {entry_number_field} BETWEEN ? AND ?"
+        self._sql_eq = f"{select} WHERE {entry_number_field} == ?"
+        # Set once iterated over, so that repeated iteration can be served from _cache
+        self._iterated = False
+        self._cache: Optional[list[T_co]] = None
 
     def __len__(self) -> int:
         return self._len
 
-    def __getitem__(self, index) -> T_co | list[T_co]:
+    def __getitem__(self, index) -> T_co | Sequence[T_co]:
         if isinstance(index, slice):
             if index.step is not None:
                 raise ValueError("Step not supported")
-            if index.start is None:
-                return [self.conversion(row) for row in self.con.execute(f"SELECT {self.fields} FROM {self.table_name} WHERE {self.entry_number_field} < ?", (index.stop,)).fetchall()]
-            if index.stop is None:
-                return [self.conversion(row) for row in self.con.execute(f"SELECT {self.fields} FROM {self.table_name} WHERE {self.entry_number_field} >= ?", (index.start,)).fetchall()]
-            return [self.conversion(row) for row in
-                    self.con.execute(f"SELECT {self.fields} FROM {self.table_name} WHERE {self.entry_number_field} BETWEEN ? AND ?", (index.start, index.stop - 1)).fetchall()]
-        else:
-            return self.conversion(
-                self.con.execute(f"SELECT {self.fields} FROM {self.table_name} WHERE {self.entry_number_field} == ?", (index,)).fetchone())
+            start, stop, _ = index.indices(self._len)
+            return _SqliteSliceView(self, start, max(start, stop))
+        if index < 0:
+            index += self._len
+        if not 0 <= index < self._len:
+            raise IndexError("Index out of range")
+        if self._cache is not None:
+            return self._cache[index]
+        return self.conversion(
+            self.con.execute(self._sql_eq, (index,)).fetchone())
+
+    def _fetch(self, sql: str, params: tuple = ()) -> Iterator[T_co]:
+        cur = self.con.cursor()
+        conversion = self.conversion
+        if not isinstance(cur, sqlite3.Cursor):
+            # APSW cursors have no fetchmany(), but step through rows without a Python-level buffer anyway
+            for row in cur.execute(sql, params):
+                yield conversion(row)
+            return
+        cur.arraysize = _FETCH_SIZE
+        cur.execute(sql, params)
+        while rows := cur.fetchmany():
+            for row in rows:
+                yield conversion(row)
+
+    def _materialize(self) -> list[T_co]:
+        if self._cache is None:
+            self._cache = list(self._fetch(self._sql_all))
+        return self._cache
 
     def __iter__(self) -> Iterator[T_co]:
-        return map(self.conversion, self.con.execute(f"SELECT {self.fields} FROM {self.table_name}"))
+        # A single pass streams without keeping anything, only repeated ones are worth materializing for
+        if not self._iterated:
+            self._iterated = True
+            return self._fetch(self._sql_all)
+        return iter(self._materialize())
 
     def __reversed__(self) -> Iterator[T_co]:
-        return map(self.conversion, self.con.execute(f"SELECT {self.fields} FROM {self.table_name} ORDER BY {self.entry_number_field} DESC"))
+        if self._cache is None and not self._iterated:
+            self._iterated = True
+            return self._fetch(self._sql_rev)
+        return reversed(self._materialize())
+
+
+class _SqliteSliceView(Sequence[T_co]):
+    """A lazy view over the entries start..stop-1 of a _SqliteBackedSequence.
+
+    Rows are only read when iterated over or indexed, the latter a chunk of _FETCH_SIZE rows at a time.
+    """
+
+    def __init__(self, seq: _SqliteBackedSequence[T_co], start: int, stop: int):
+        self.seq = seq
+        self.start = start
+        self.stop = stop
+        self._chunk_start = -1
+        self._chunk: list[T_co] = []
+
+    def __len__(self) -> int:
+        return self.stop - self.start
+
+    def __getitem__(self, index) -> T_co | Sequence[T_co]:
+        if isinstance(index, slice):
+            if index.step is not None:
+                raise ValueError("Step not supported")
+            start, stop, _ = index.indices(len(self))
+            return _SqliteSliceView(self.seq, self.start + start, self.start + max(start, stop))
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("Index out of range")
+        chunk_start = self.start + index - index % _FETCH_SIZE
+        if chunk_start != self._chunk_start:
+            self._chunk = list(self.seq._fetch(self.seq._sql_between, (chunk_start, min(chunk_start + _FETCH_SIZE, self.stop) - 1)))
+            self._chunk_start = chunk_start
+        return self._chunk[index % _FETCH_SIZE]
+
+    def __iter__(self) -> Iterator[T_co]:
+        if self.start == self.stop:
+            return iter(())
+        return self.seq._fetch(self.seq._sql_between, (self.start, self.stop - 1))
 
 
 class SQLiteExternalDirectory(ExternalDirectory):
+    """An external directory stored in an SQLite database.
+
+    The connection may be either a sqlite3.Connection or, for lower per-query overhead, an apsw.Connection.
+    """
+
     def __init__(self, con: sqlite3.Connection, table_name: str = "offsets", entry_number_field: str = "file_number", filename_field: str = "filename", offset_field: str = "header_offset", compressed_size_field: str = "compressed_size"):
         self.con = con
         self.table_name = table_name
@@ -53,8 +176,7 @@ class SQLiteExternalDirectory(ExternalDirectory):
         self.filename_field = filename_field
         self.offset_field = offset_field
         self.compressed_size_field = compressed_size_field
-        self._len = con.execute(
-            f"SELECT COUNT(*) FROM {table_name}").fetchone()[0]
+        self._len = _read_count(con, table_name)
 
     @property
     def len(self) -> int:
@@ -64,23 +186,48 @@ class SQLiteExternalDirectory(ExternalDirectory):
         return _SqliteBackedSequence(self.con, self.table_name, self.entry_number_field, self.filename_field, self._len, lambda x: x[0])
 
     def _tuple_to_zinfo(self, tuple) -> ZipInfo:
-        zi = ZipInfo(tuple[2])
-        zi.compress_size = tuple[1]
-        zi.header_offset = tuple[0]
-        return zi
+        return _new_zinfo(tuple[2], tuple[0], tuple[1])
 
     def infolist(self) -> Sequence[ZipInfo]:
         return _SqliteBackedSequence(self.con, self.table_name, self.entry_number_field, f"{self.offset_field},{self.compressed_size_field},{self.filename_field}", self._len, self._tuple_to_zinfo)
 
     def getinfo(self, name: str) -> ZipInfo:
-        zi = ZipInfo(name)
-        (zi.header_offset, zi.compress_size) = self.con.execute(
+        (header_offset, compress_size) = self.con.execute(
             f"SELECT {self.offset_field},{self.compressed_size_field} FROM {self.table_name} WHERE {self.filename_field} = ?", (name,)).fetchone()
-        return zi
+        return _new_zinfo(name, header_offset, compress_size)
+
+    def _lookup(self, keys: Iterable, key_field: str) -> list[ZipInfo]:
+        keys = list(keys)
+        # The keys are passed as a single JSON array, so the statement text is the same whatever the batch size.
+        # CROSS JOIN makes SQLite walk the keys and look each up through the index, instead of scanning the table.
+        found = {row[0]: row[1:] for row in self.con.execute(
+            f"SELECT j.value,o.{self.offset_field},o.{self.compressed_size_field},o.{self.filename_field} FROM json_each(?) j CROSS JOIN {self.table_name} o ON o.{key_field} = j.value",
+            (json.dumps(keys),))}
+        try:
+            return [self._tuple_to_zinfo(found[key]) for key in keys]
+        except KeyError as e:
+            raise KeyError(f"There is no item {e.args[0]!r} in the archive") from None
+
+    def getinfos(self, names: Iterable[str]) -> list[ZipInfo]:
+        return self._lookup(names, self.filename_field)
+
+    def getpositions(self, positions: Iterable[int]) -> list[ZipInfo]:
+        return self._lookup(positions, self.entry_number_field)
+
+
+def _read_count(con: sqlite3.Connection, table_name: str) -> int:
+    """Returns the number of entries in the given table, preferring the count stored in the edzip_meta table over a COUNT(*)."""
+    if con.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'edzip_meta'").fetchone() is not None:
+        row = con.execute("SELECT value FROM edzip_meta WHERE key = ?", (f"{table_name}.count",)).fetchone()
+        if row is not None:
+            return row[0]
+    # Databases created before the edzip_meta table was introduced
+    return con.execute(f"SELECT COUNT(*) FROM {table_name}").fetchone()[0]
 
 
 def create_sqlite_table(con: sqlite3.Connection):
     con.execute("CREATE TABLE offsets (file_number INTEGER PRIMARY KEY, filename TEXT, header_offset INTEGER, compressed_size INTEGER)")
+    con.execute("CREATE TABLE edzip_meta (key TEXT PRIMARY KEY, value INTEGER)")
 
 
 def create_sqlite_indexes(con: sqlite3.Connection):
@@ -92,40 +239,175 @@ def insert_zipinfo_into_sqlite(con: sqlite3.Connection, file_number: int, filena
                 (file_number, filename, header_offset, compressed_size))
 
 
-def create_sqlite_directory_from_zip(zipfile: ZipFile, filename: str) -> sqlite3.Connection:
-    """Creates, from the given ZipFile, an SQLite database compatible with ZipFileWithExternalSqliteDirectory.
+def _iter_central_directory(fp: BinaryIO) -> tuple[int, Iterator[tuple[str, int, int]]]:
+    """Parses the central directory of the given ZIP file directly, without constructing ZipInfo objects.
+
+    The central directory is memory-mapped (or, for file objects that are not plain files, read in one go) and its
+    records decoded in place with a precompiled struct, yielding the same filenames and offsets ZipFile would report.
 
     Args:
-        zipfile (ZipFile): A ZipFile object
-        filename (str): The name of the SQLite database file to be created. Will be removed and recreated if it already exists.
+        fp (BinaryIO): A seekable binary file object positioned anywhere in the ZIP file.
 
     Returns:
-        sqlite3.Connection: A connection to the created SQLite database.
+        (int,Iterator[tuple[str,int,int]]): the number of entries, and an iterator over (filename, header offset,
+            compressed size) for each entry.
     """
+    try:
+        endrec = _EndRecData(fp)
+    except OSError:
+        raise BadZipFile("File is not a zip file")
+    if not endrec:
+        raise BadZipFile("File is not a zip file")
+    size_cd = endrec[_ECD_SIZE]
+    offset_cd = endrec[_ECD_OFFSET]
+    # "concat" is zero, unless zip was concatenated to another file
+    concat = endrec[_ECD_LOCATION] - size_cd - offset_cd
+    if endrec[_ECD_SIGNATURE] == stringEndArchive64:
+        concat -= (sizeEndCentDir64 + sizeEndCentDir64Locator)
+    start = offset_cd + concat
+    if start < 0:
+        raise BadZipFile("Bad offset for central directory")
+
+    def entries() -> Iterator[tuple[str, int, int]]:
+        # Mapped only once iteration starts, so that the mapping is always released by the finally below
+        data = _mmap(fp)
+        pos = start
+        if data is None:
+            fp.seek(start)
+            data = fp.read(size_cd)
+            pos = 0
+        end = pos + size_cd
+        try:
+            if len(data) < end:
+                raise BadZipFile("Truncated central directory")
+            while pos < end:
+                if end - pos < sizeCentralDir:
+                    raise BadZipFile("Truncated central directory")
+                centdir = _CD_STRUCT.unpack_from(data, pos)
+                if centdir[_CD_SIGNATURE] != stringCentralDir:
+                    raise BadZipFile("Bad magic number for central directory")
+                pos += sizeCentralDir
+                name_end = pos + centdir[_CD_FILENAME_LENGTH]
+                filename = data[pos:name_end].decode('utf-8' if centdir[_CD_FLAG_BITS] & _MASK_UTF_FILENAME else 'cp437')
+                # Same normalization as done by ZipInfo
+                null_byte = filename.find(chr(0))
+                if null_byte >= 0:
+                    filename = filename[0:null_byte]
+                if os.sep != "/" and os.sep in filename:
+                    filename = filename.replace(os.sep, "/")
+                compress_size = centdir[_CD_COMPRESSED_SIZE]
+                header_offset = centdir[_CD_LOCAL_HEADER_OFFSET]
+                extra_end = name_end + centdir[_CD_EXTRA_FIELD_LENGTH]
+                if compress_size == 0xFFFFFFFF or header_offset == 0xFFFFFFFF:
+                    compress_size, header_offset = _decode_zip64_extra(
+                        data[name_end:extra_end], centdir[_CD_UNCOMPRESSED_SIZE], compress_size, header_offset)
+                pos = extra_end + centdir[_CD_COMMENT_LENGTH]
+                yield filename, header_offset + concat, compress_size
+        finally:
+            if isinstance(data, mmap.mmap):
+                data.close()
+
+    return endrec[_ECD_ENTRIES_TOTAL], entries()
+
+
+def _mmap(fp: BinaryIO) -> Optional[mmap.mmap]:
+    """Memory-maps the whole file underlying the given file object read-only, or returns None if that is not possible."""
+    fd = _fileno(fp)
+    if fd is None:
+        return None
+    try:
+        return mmap.mmap(fd, 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+
+
+def _decode_zip64_extra(extra: bytes, file_size: int, compress_size: int, header_offset: int) -> tuple[int, int]:
+    """Returns the compressed size and header offset of an entry, taking into account its ZIP64 extra field."""
+    pos = 0
+    while pos + 4 <= len(extra):
+        tp, ln = struct.unpack_from('<HH', extra, pos)
+        if pos + 4 + ln > len(extra):
+            raise BadZipFile("Corrupt extra field %04x (size=%d)" % (tp, ln))
+        if tp == 0x0001:
+            values = iter(struct.unpack_from(f'<{ln // 8}Q', extra, pos + 4))
+            try:
+                if file_size == 0xFFFFFFFF:
+                    next(values)
+                if compress_size == 0xFFFFFFFF:
+                    compress_size = next(values)
+                if header_offset == 0xFFFFFFFF:
+                    header_offset = next(values)
+            except StopIteration:
+                raise BadZipFile("Corrupt extra field 0001 (ZIP64)") from None
+            break
+        pos += 4 + ln
+    return compress_size, header_offset
+
+
+def _create_sqlite_directory(entries: Iterable[tuple[str, int, int]], total: int, filename: str) -> sqlite3.Connection:
     if os.path.exists(filename):
         os.remove(filename)
     con = sqlite3.connect(filename)
     with con:
         create_sqlite_table(con)
+    # The database is rebuilt from scratch on failure, so durability can be traded for load speed
+    con.executescript("PRAGMA journal_mode=WAL; PRAGMA synchronous=OFF; PRAGMA temp_store=MEMORY; PRAGMA cache_size=-65536")
     with con:
-        for i, zinfo in enumerate(tqdm(zipfile.infolist(), unit='entr', dynamic_ncols=True)):
-            insert_zipinfo_into_sqlite(
-                con, i, zinfo.filename, zinfo.header_offset, zinfo.compress_size)
+        con.executemany("INSERT INTO offsets (file_number, filename, header_offset, compressed_size) VALUES (?,?,?,?)",
+                        ((i, *entry) for i, entry in enumerate(tqdm(entries, total=total, unit='entr', dynamic_ncols=True))))
+        con.execute("INSERT INTO edzip_meta (key, value) SELECT 'offsets.count', COUNT(*) FROM offsets")
     with con:
         create_sqlite_indexes(con)
+    with con:
+        con.execute("ANALYZE")
+    # Return to a rollback journal so that the finished database is a single, read-only friendly file
+    con.executescript("PRAGMA journal_mode=DELETE; PRAGMA synchronous=FULL")
     with con:
         con.execute("VACUUM")
     return con
 
 
+def create_sqlite_directory_from_zip(zipfile: ZipFile, filename: str) -> sqlite3.Connection:
+    """Creates, from the given ZipFile, an SQLite database compatible with ZipFileWithExternalSqliteDirectory.
+
+    Args:
+        zipfile (ZipFile): A ZipFile object
+        filename (str): The name of the SQLite database file to be created. Will be removed and recreated if it already exists.
+
+    Returns:
+        sqlite3.Connection: A connection to the created SQLite database.
+    """
+    infolist = zipfile.infolist()
+    return _create_sqlite_directory(((zinfo.filename, zinfo.header_offset, zinfo.compress_size) for zinfo in infolist), len(infolist), filename)
+
+
+def create_sqlite_directory_from_file(file: Union[str, os.PathLike, BinaryIO], filename: str) -> sqlite3.Connection:
+    """Creates, from the given ZIP file, an SQLite database compatible with ZipFileWithExternalSqliteDirectory.
+
+    Faster than create_sqlite_directory_from_zip() for large archives, as the central directory is parsed directly
+    instead of through ZipFile.
+
+    Args:
+        file (str or os.PathLike or BinaryIO): The ZIP file, either as a path or a seekable binary file object
+        filename (str): The name of the SQLite database file to be created. Will be removed and recreated if it already exists.
+
+    Returns:
+        sqlite3.Connection: A connection to the created SQLite database.
+    """
+    if isinstance(file, (str, os.PathLike)):
+        with open(file, 'rb') as fp:
+            return create_sqlite_directory_from_file(fp, filename)
+    total, entries = _iter_central_directory(file)
+    return _create_sqlite_directory(entries, total, filename)
+
+
 @click.command()
 @click.argument("filename")
 @click.argument("sqlite-filename", required=False)
 def cli(filename: str, sqlite_filename: Optional[str] = None):
     if sqlite_filename is None:
         sqlite_filename = filename + ".offsets.sqlite3"
-    with ZipFile(filename, 'r') as zf:
-        create_sqlite_directory_from_zip(zf, sqlite_filename)
+    create_sqlite_directory_from_file(filename, sqlite_filename)
 
 
 if __name__ == "__main__":
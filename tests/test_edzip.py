@@ -1,9 +1,18 @@
 from io import BytesIO
+try:
+    import apsw
+except ImportError:
+    apsw = None
+import gzip
+import os
+import struct
+import tempfile
 import unittest
-from zipfile import ZipFile, ZipInfo
+from unittest import mock
+from zipfile import ZIP_DEFLATED, BadZipFile, ZipFile, ZipInfo
 
 from edzip import EDZipFile
-from edzip.sqlite import SQLiteExternalDirectory, create_sqlite_directory_from_zip
+from edzip.sqlite import SQLiteExternalDirectory, create_sqlite_directory_from_file, create_sqlite_directory_from_zip
 
 class TestCreateSqliteDirectoryFromZip(unittest.TestCase):
 
@@ -14,6 +23,8 @@ class TestCreateSqliteDirectoryFromZip(unittest.TestCase):
             zf.writestr("test2.txt", "Hello again!")
             zf.writestr("test3.txt", "Goodbye!")
             con = create_sqlite_directory_from_zip(zf, ":memory:")
+        self.buffer = buffer
+        self.con = con
         self.zip_file = ZipFile(buffer, 'r')
         self.edzip_file = EDZipFile(buffer, SQLiteExternalDirectory(con))
 
@@ -23,11 +34,90 @@ class TestCreateSqliteDirectoryFromZip(unittest.TestCase):
     def test_namelist(self):
         self.assertEqual(list(self.edzip_file.namelist()), ["test.txt", "test2.txt", "test3.txt"])
         self.assertEqual(list(self.edzip_file.namelist().__reversed__()), ["test3.txt", "test2.txt", "test.txt"])
+        namelist = self.edzip_file.namelist()
+        self.assertEqual(list(namelist), ["test.txt", "test2.txt", "test3.txt"])
+        self.assertIsNone(namelist._cache)
+        self.assertEqual(list(namelist), ["test.txt", "test2.txt", "test3.txt"])
+        self.assertIsNotNone(namelist._cache)
+        self.assertEqual(list(reversed(namelist)), ["test3.txt", "test2.txt", "test.txt"])
+        self.assertEqual(namelist[1], "test2.txt")
+        self.assertEqual(namelist[-1], "test3.txt")
+        with self.assertRaises(IndexError):
+            namelist[3]
+        namelist = self.edzip_file.namelist()
+        self.assertEqual(namelist[-1], "test3.txt")
+        with self.assertRaises(IndexError):
+            namelist[3]
+        with self.assertRaises(IndexError):
+            namelist[-4]
     
     def test_fillinfo(self):
         infolist = list(map(lambda x: x.FileHeader(), map(self.edzip_file.fillinfo,self.edzip_file.infolist())))
         self.assertEqual(infolist, list(map(lambda x: x.FileHeader(), self.zip_file.infolist())))
 
+    def test_fillinfo_need_times(self):
+        info = self.edzip_file.fillinfo(self.edzip_file.getinfo("test2.txt"), need_times=False)
+        self.assertEqual(info.date_time, (1980, 1, 1, 0, 0, 0))
+        self.assertEqual(info.file_size, 12)
+        self.assertEqual(self.edzip_file.fillinfo(info).date_time, self.zip_file.getinfo("test2.txt").date_time)
+
+    def test_fillinfos(self):
+        infolist = [x.FileHeader() for x in self.edzip_file.fillinfos(self.edzip_file.infolist())]
+        self.assertEqual(infolist, [x.FileHeader() for x in self.zip_file.infolist()])
+
+    def test_fillinfo_extra(self):
+        buffer = BytesIO()
+        with ZipFile(buffer, "w") as zf:
+            zinfo = ZipInfo("extra.txt")
+            zinfo.extra = struct.pack("<HH", 0xcafe, 4) + b"abcd"
+            zf.writestr(zinfo, "Extra!")
+            zf.writestr("short.txt", "Short name!")
+            zf.writestr("x" * 5000 + ".txt", "Long name!")
+            con = create_sqlite_directory_from_zip(zf, ":memory:")
+        with EDZipFile(buffer, SQLiteExternalDirectory(con)) as edzip_file:
+            infos = [edzip_file.fillinfo(zinfo) for zinfo in edzip_file.infolist()]
+            self.assertEqual(infos[0].extra, struct.pack("<HH", 0xcafe, 4) + b"abcd")
+            self.assertEqual(infos[2].orig_filename, b"x" * 5000 + b".txt")
+            with edzip_file.open("extra.txt") as f:
+                self.assertEqual(f.read(), b"Extra!")
+            with edzip_file.open("x" * 5000 + ".txt") as f:
+                self.assertEqual(f.read(), b"Long name!")
+        with tempfile.TemporaryDirectory() as tmpdir:
+            zip_filename = os.path.join(tmpdir, "test.zip")
+            with open(zip_filename, "wb") as f:
+                f.write(buffer.getvalue())
+            with EDZipFile(zip_filename, SQLiteExternalDirectory(con)) as edzip_file:
+                infos = edzip_file.fillinfos(edzip_file.infolist())
+                self.assertEqual(infos[0].extra, struct.pack("<HH", 0xcafe, 4) + b"abcd")
+                self.assertEqual(infos[1].orig_filename, b"short.txt")
+                self.assertEqual(infos[2].orig_filename, b"x" * 5000 + b".txt")
+
+    def test_compressed_file_object(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            gz_filename = os.path.join(tmpdir, "test.zip.gz")
+            with gzip.open(gz_filename, "wb") as f:
+                f.write(self.buffer.getvalue())
+            with gzip.open(gz_filename, "rb") as gz:
+                with EDZipFile(gz, SQLiteExternalDirectory(self.con)) as edzip_file:
+                    infos = edzip_file.fillinfos(edzip_file.infolist())
+                    self.assertEqual([x.FileHeader() for x in infos], [x.FileHeader() for x in self.zip_file.infolist()])
+                    self.assertEqual(list(edzip_file.open_many(["test2.txt"])), [("test2.txt", b"Hello again!")])
+
+    def test_unbuffered_file(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            zip_filename = os.path.join(tmpdir, "test.zip")
+            with open(zip_filename, "wb") as f:
+                f.write(self.buffer.getvalue())
+            with open(zip_filename, "rb", buffering=0) as raw:
+                with EDZipFile(raw, SQLiteExternalDirectory(self.con)) as edzip_file:
+                    infos = edzip_file.fillinfos(reversed(edzip_file.infolist()))
+                    self.assertEqual([x.FileHeader() for x in infos], [x.FileHeader() for x in reversed(self.zip_file.infolist())])
+                    with edzip_file.open("test2.txt") as f:
+                        self.assertEqual(f.read(), b"Hello again!")
+                    with edzip_file.open("test.txt") as f:
+                        self.assertEqual(f.read(), b"Hello, world!")
+                self.assertFalse(raw.closed)
+
     def test_namelist_slicing(self):
         namelist = self.edzip_file.namelist()
         slice = namelist[1:3]
@@ -42,6 +132,12 @@ class TestCreateSqliteDirectoryFromZip(unittest.TestCase):
         self.assertEqual(len(slice), 2)
         self.assertEqual(slice[0], 'test2.txt')
         self.assertEqual(slice[1], 'test3.txt')
+        self.assertEqual(slice[-1], 'test3.txt')
+        self.assertEqual(list(slice), ['test2.txt', 'test3.txt'])
+        self.assertEqual(list(slice[1:]), ['test3.txt'])
+        self.assertEqual(list(namelist[2:1]), [])
+        with self.assertRaises(IndexError):
+            slice[2]
 
     def test_infolist(self):
         infolist = self.edzip_file.infolist()
@@ -49,20 +145,113 @@ class TestCreateSqliteDirectoryFromZip(unittest.TestCase):
         self.assertIsInstance(infolist[0], ZipInfo)
         self.assertEqual(infolist[0].filename, "test.txt")
         self.assertEqual(infolist[0].header_offset, 0)
+        self.assertEqual(infolist[0].date_time, ZipInfo("test.txt").date_time)
+        self.assertIn("filename='test.txt'", repr(infolist[0]))
         self.assertEqual(infolist[1].filename, "test2.txt")
         self.assertGreater(infolist[1].header_offset, infolist[0].header_offset)
         self.assertEqual(infolist[2].filename, "test3.txt")
         self.assertGreater(infolist[2].header_offset, infolist[1].header_offset)
 
+    def test_infolist_materialize(self):
+        infolist = self.edzip_file.infolist(materialize=True)
+        self.assertIsInstance(infolist, list)
+        self.assertEqual([info.filename for info in infolist], ["test.txt", "test2.txt", "test3.txt"])
+        self.assertIs(self.edzip_file.infolist(materialize=True), infolist)
+
     def test_getinfo(self):
         info = self.edzip_file.getinfo("test2.txt")
         self.assertIsInstance(info, ZipInfo)
         self.assertEqual(info.filename, "test2.txt")
         self.assertGreater(info.header_offset, 0)
 
+    def test_getinfo_cached(self):
+        info = self.edzip_file.getinfo("test2.txt")
+        self.assertIs(self.edzip_file.getinfo("test2.txt"), info)
+        with self.edzip_file.open("test2.txt") as f:
+            f.read()
+        # open() does not fill the cached object in place
+        self.assertFalse(hasattr(info, "CRC"))
+        self.edzip_file.close()
+        self.assertEqual(len(self.edzip_file._getinfo_cache), 0)
+
+    def test_getinfos(self):
+        infos = self.edzip_file.getinfos(["test3.txt", "test.txt", "test3.txt"])
+        self.assertEqual([info.filename for info in infos], ["test3.txt", "test.txt", "test3.txt"])
+        self.assertEqual(infos[1].header_offset, 0)
+        self.assertEqual(infos[0].header_offset, self.edzip_file.getinfo("test3.txt").header_offset)
+        with self.assertRaises(KeyError):
+            self.edzip_file.getinfos(["test.txt", "missing.txt"])
+
+    def test_getpositions(self):
+        infos = self.edzip_file.getpositions([2, 0])
+        self.assertEqual([info.filename for info in infos], ["test3.txt", "test.txt"])
+        self.assertEqual(infos[1].header_offset, 0)
+        # Batch sizes are not limited by the maximum number of SQL parameters
+        self.assertEqual(len(self.edzip_file.getpositions([0, 1, 2] * 10000)), 30000)
+
     def test_open(self):
         with self.edzip_file.open("test2.txt") as f:
             self.assertEqual(f.read(), b"Hello again!")
+        info = self.edzip_file.infolist()[1]
+        with self.edzip_file.open(info) as f:
+            self.assertEqual(f.read(), b"Hello again!")
+        self.assertEqual(info.FileHeader(), self.zip_file.getinfo("test2.txt").FileHeader())
+
+    def test_open_many(self):
+        names = ["test3.txt", "test.txt", "test2.txt", "test3.txt"]
+        expected = [(name, self.zip_file.read(name)) for name in names]
+        self.assertEqual(list(self.edzip_file.open_many(names)), expected)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            zip_filename = os.path.join(tmpdir, "test.zip")
+            with ZipFile(zip_filename, "w") as zf:
+                zf.writestr("test.txt", "Hello, world!")
+                zf.writestr("test2.txt", "Hello again!", compress_type=ZIP_DEFLATED)
+                zf.writestr("test3.txt", "Goodbye!")
+            with ZipFile(zip_filename) as zf:
+                con = create_sqlite_directory_from_zip(zf, ":memory:")
+            with EDZipFile(zip_filename, SQLiteExternalDirectory(con)) as edzip_file:
+                self.assertEqual(list(edzip_file.open_many(names, max_workers=2)), expected)
+
+    def test_open_many_bounded(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            zip_filename = os.path.join(tmpdir, "test.zip")
+            names = [f"test{i}.bin" for i in range(10)]
+            with ZipFile(zip_filename, "w") as zf:
+                for i, name in enumerate(names):
+                    zf.writestr(name, bytes([i]) * 1000)
+            con = create_sqlite_directory_from_file(zip_filename, ":memory:")
+            # Small enough a span for each entry to be read separately
+            with EDZipFile(zip_filename, SQLiteExternalDirectory(con)) as edzip_file, \
+                    mock.patch("edzip._PREAD_SPAN", 1000), mock.patch("os.pread", side_effect=os.pread) as pread:
+                def data_reads():
+                    return sum(1 for call in pread.call_args_list if call.args[1] == 1000)
+                results = edzip_file.open_many(names, max_workers=1)
+                self.assertEqual(next(results), ("test0.bin", b"\x00" * 1000))
+                self.assertLessEqual(data_reads(), 2)
+                self.assertEqual([data[0] for _, data in results], list(range(1, 10)))
+                self.assertEqual(data_reads(), 10)
+
+    def test_open_many_after_close(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            zip_filename = os.path.join(tmpdir, "test.zip")
+            with open(zip_filename, "wb") as f:
+                f.write(self.buffer.getvalue())
+            edzip_file = EDZipFile(zip_filename, SQLiteExternalDirectory(self.con))
+            results = edzip_file.open_many(["test.txt", "test2.txt", "test3.txt"])
+            self.assertEqual(next(results), ("test.txt", b"Hello, world!"))
+            edzip_file.close()
+            self.assertEqual(list(results), [("test2.txt", b"Hello again!"), ("test3.txt", b"Goodbye!")])
+
+    def test_open_many_short_reads(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            zip_filename = os.path.join(tmpdir, "test.zip")
+            with open(zip_filename, "wb") as f:
+                f.write(self.buffer.getvalue())
+            real_pread = os.pread
+            with EDZipFile(zip_filename, SQLiteExternalDirectory(self.con)) as edzip_file, \
+                    mock.patch("os.pread", side_effect=lambda fd, size, offset: real_pread(fd, min(size, 5), offset)):
+                self.assertEqual(list(edzip_file.open_many(["test2.txt", "test.txt"])),
+                                 [("test2.txt", b"Hello again!"), ("test.txt", b"Hello, world!")])
 
     def test_stream_from(self):
         stream = self.edzip_file.stream_from()
@@ -76,4 +265,109 @@ class TestCreateSqliteDirectoryFromZip(unittest.TestCase):
         self.assertEqual(size, 12)
         self.assertEqual(next(data), b"Hello again!")
         (filename, size, data) = next(stream)
-        self.assertEqual(filename, b"test3.txt")
\ No newline at end of file
+        self.assertEqual(filename, b"test3.txt")
+
+class TestCreateSqliteDirectoryFromFile(unittest.TestCase):
+
+    def assertSameDirectory(self, buffer):
+        with ZipFile(buffer, "r") as zf:
+            expected = [(zinfo.filename, zinfo.header_offset, zinfo.compress_size) for zinfo in zf.infolist()]
+        con = create_sqlite_directory_from_file(buffer, ":memory:")
+        self.assertEqual(con.execute("SELECT filename, header_offset, compressed_size FROM offsets ORDER BY file_number").fetchall(), expected)
+        with EDZipFile(buffer, SQLiteExternalDirectory(con)) as edzip_file:
+            for name in edzip_file.namelist():
+                with edzip_file.open(name) as f:
+                    self.assertEqual(f.read(), name.encode("utf-8"))
+
+    def test_create(self):
+        buffer = BytesIO()
+        buffer.write(b"prefix data")
+        with ZipFile(buffer, "a") as zf:
+            zf.writestr("test.txt", "test.txt")
+            zf.writestr("tëst/ünicode.txt", "tëst/ünicode.txt")
+            zinfo = ZipInfo("extra.txt")
+            zinfo.extra = struct.pack("<HH", 0xcafe, 4) + b"abcd"
+            zinfo.comment = b"a comment"
+            zf.writestr(zinfo, "extra.txt")
+        self.assertSameDirectory(buffer)
+
+    def test_create_zip64(self):
+        buffer = BytesIO()
+        with mock.patch("zipfile.ZIP64_LIMIT", 10), mock.patch("zipfile.ZIP_FILECOUNT_LIMIT", 1):
+            with ZipFile(buffer, "w") as zf:
+                for i in range(3):
+                    zf.writestr(f"test{i}.txt", f"test{i}.txt")
+        self.assertSameDirectory(buffer)
+
+    def test_create_corrupt_zip64_extra(self):
+        buffer = BytesIO()
+        with mock.patch("zipfile.ZIP64_LIMIT", 10):
+            with ZipFile(buffer, "w") as zf:
+                zf.writestr("test.txt", "test.txt" * 4)
+        data = bytearray(buffer.getvalue())
+        # Claim a longer ZIP64 field than the extra field holds
+        pos = data.index(b"PK\x01\x02") + 46 + len("test.txt")
+        struct.pack_into("<H", data, pos + 2, 64)
+        with self.assertRaisesRegex(BadZipFile, "Corrupt extra field 0001"):
+            create_sqlite_directory_from_file(BytesIO(bytes(data)), ":memory:")
+
+    def test_count_from_meta(self):
+        buffer = BytesIO()
+        with ZipFile(buffer, "w") as zf:
+            zf.writestr("test.txt", "test.txt")
+            zf.writestr("test2.txt", "test2.txt")
+        con = create_sqlite_directory_from_file(buffer, ":memory:")
+        self.assertEqual(con.execute("SELECT value FROM edzip_meta WHERE key = 'offsets.count'").fetchone(), (2,))
+        self.assertEqual(SQLiteExternalDirectory(con).len, 2)
+        # Databases without the edzip_meta table fall back to counting
+        con.execute("DROP TABLE edzip_meta")
+        self.assertEqual(SQLiteExternalDirectory(con).len, 2)
+        # An unrelated table named meta in a user-built database does not get in the way
+        con.execute("CREATE TABLE meta (name TEXT)")
+        self.assertEqual(SQLiteExternalDirectory(con).len, 2)
+
+    def test_create_from_path(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            zip_filename = os.path.join(tmpdir, "test.zip")
+            with ZipFile(zip_filename, "w") as zf:
+                zf.writestr("test.txt", "test.txt")
+            con = create_sqlite_directory_from_file(zip_filename, os.path.join(tmpdir, "test.sqlite3"))
+            self.assertEqual(con.execute("SELECT filename, header_offset FROM offsets").fetchall(), [("test.txt", 0)])
+            con.close()
+
+    def test_create_from_compressed_file_object(self):
+        buffer = BytesIO()
+        with ZipFile(buffer, "w") as zf:
+            zf.writestr("test.txt", "test.txt")
+            zf.writestr("test2.txt", "test2.txt")
+        with tempfile.TemporaryDirectory() as tmpdir:
+            gz_filename = os.path.join(tmpdir, "test.zip.gz")
+            with gzip.open(gz_filename, "wb") as f:
+                f.write(buffer.getvalue())
+            with gzip.open(gz_filename, "rb") as gz:
+                self.assertSameDirectory(gz)
+
+
+@unittest.skipIf(apsw is None, "apsw not installed")
+class TestAPSWExternalDirectory(unittest.TestCase):
+
+    def test_apsw(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            zip_filename = os.path.join(tmpdir, "test.zip")
+            with ZipFile(zip_filename, "w") as zf:
+                zf.writestr("test.txt", "Hello, world!")
+                zf.writestr("test2.txt", "Hello again!")
+                zf.writestr("test3.txt", "Goodbye!")
+            sqlite_filename = os.path.join(tmpdir, "test.sqlite3")
+            create_sqlite_directory_from_file(zip_filename, sqlite_filename).close()
+            con = apsw.Connection(sqlite_filename)
+            with EDZipFile(zip_filename, SQLiteExternalDirectory(con)) as edzip_file:
+                self.assertEqual(len(edzip_file), 3)
+                self.assertEqual(list(edzip_file.namelist()), ["test.txt", "test2.txt", "test3.txt"])
+                self.assertEqual(list(reversed(edzip_file.namelist())), ["test3.txt", "test2.txt", "test.txt"])
+                self.assertEqual(list(edzip_file.namelist()[1:]), ["test2.txt", "test3.txt"])
+                self.assertEqual(edzip_file.infolist()[1].filename, "test2.txt")
+                self.assertEqual([info.filename for info in edzip_file.getinfos(["test3.txt", "test.txt"])], ["test3.txt", "test.txt"])
+                with edzip_file.open("test2.txt") as f:
+                    self.assertEqual(f.read(), b"Hello again!")
+            con.close()